@@ -1,15 +1,31 @@
 from enum import Enum
 import sys
 import time
-import json
+import asyncio
+import contextlib
 import functools
+import hashlib
+import json
+import importlib.util
+import shutil
+import struct
+import subprocess
+import tempfile
 import zipfile
 import os
 import logging
 import boto3
 import unittest
+from boto3.s3.transfer import S3Transfer, TransferConfig
+from botocore.config import Config
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import Dict, List, Any
 
+try:
+    import aioboto3  # optional; enables event-loop based upload fan-out
+except ImportError:
+    aioboto3 = None
+
 logger = logging.getLogger()
 
 DEFAULTS_RUN_UNIT_TESTS             = True
@@ -18,16 +34,29 @@ DEFAULTS_UPLOAD_PACKAGES            = True
 DEFAULTS_CREATE_STACKS              = True
 DEFAULTS_COLLECT_STACK_OUTPUTS      = True
 DEFAULTS_UPLOAD_STATIC_ARTIFACTS    = False
+DEFAULTS_ZIP_COMPRESS_LEVEL         = 1
+DEFAULTS_CACHE_TEST_RESULTS         = True
+
+TEST_CACHE_FILENAME                 = ".awsdeploy.testcache"
 
 COMPILED_PYTHON_EXTENSION               = ".pyc"
 ZIPFILE_EXTENSION                       = ".zip"
 INIT_FILENAME                           = "__init__.py"
 PYSRC_DIRS_ALWAYS_EXCLUDE               = ["tests", "__pycache__"]
+ZIP_COPY_BUFFER_SIZE                    = 1024 * 1024
+ZIP_WRITE_BUFFER_SIZE                   = 1024 * 1024
+PARALLEL_ZIP_MIN_FILES                  = 128
 AWS_CAPABILITY_IAM                      = "CAPABILITY_IAM"
-AWS_CLOUDFORMATION_WAITER_CONFIG        = { "Delay": 30, "MaxAttempts": 50 }
-AWS_COLLECT_OUTPUTS_CONFIG              = { "Timeout": 50, "SleepSeconds": 5 }
 AWS_CLOUDFORMATION_CREATE_COMPLETE      = "CREATE_COMPLETE"
 AWS_CLOUDFORMATION_CREATE_IN_PROGRESS   = "CREATE_IN_PROGRESS"
+AWS_CLOUDFORMATION_WAITER_CONFIG        = { "Delay": 5, "MaxAttempts": 720 }
+AWS_S3_MULTIPART_THRESHOLD              = 8 * 1024 * 1024
+AWS_S3_MULTIPART_CHUNKSIZE              = 64 * 1024 * 1024
+AWS_S3_MAX_CONCURRENCY                  = 16
+AWS_S3_UPLOAD_MAX_WORKERS               = 8
+AWS_S3_DIRECTORY_UPLOAD_MAX_WORKERS     = 32
+AWS_MAX_POOL_CONNECTIONS                = 64
+AWS_RETRY_CONFIG                        = { "max_attempts": 10, "mode": "adaptive" }
 
 
 class Status(Enum):
@@ -51,10 +80,12 @@ class DeploymentStep(object):
 class AwsDeployExpert(object):
 
     def __init__(self, config: Dict) -> None:
-        self.config     = config
-        self.cf_client  = None
-        self.s3_client  = None
-        self.state      = {}
+        self.config             = config
+        self.cf_client          = None
+        self.s3_client          = None
+        self.s3_transfer        = None
+        self.s3_transfer_config = None
+        self.state              = {}
 
     def deploy(self) -> Status:
         """ Starts deployment pipeline """
@@ -75,8 +106,7 @@ class AwsDeployExpert(object):
             DeploymentStep('run_tests', self._run_tests),
             DeploymentStep('make_packages', self._make_packages),
             DeploymentStep('init_aws', self._init_aws),
-            DeploymentStep('upload_packages_to_s3', self._upload_packages_to_s3_bucket),
-            DeploymentStep('create_stacks', self._create_stacks),
+            DeploymentStep('upload_packages_and_create_stacks', self._upload_packages_and_create_stacks),
             DeploymentStep('collect_stack_outputs', self._collect_stack_outputs),
             DeploymentStep('upload_static_artifacts', self._upload_static_artifacts),
         ]
@@ -90,7 +120,14 @@ class AwsDeployExpert(object):
         if not sourcePath:
             logger.error("missing sourcePath")
             return Status.FAILED
+        cacheEnabled = self.config.get("options",{}).get("cacheTestResults", DEFAULTS_CACHE_TEST_RESULTS)
+        digest = hashSourceTree(sourcePath) if cacheEnabled else None
+        if cacheEnabled and digest == readTestCacheDigest():
+            logger.info("Sources under '%s' unchanged since last passing run. Skipping tests", sourcePath)
+            return Status.SKIPPED
         passed = runUnitTests(sourcePath)
+        if passed and cacheEnabled:
+            writeTestCacheDigest(digest)
         return Status.OK if passed else Status.FAILED
 
     def _make_packages(self) -> Status:
@@ -102,13 +139,17 @@ class AwsDeployExpert(object):
         if not sourcePath:
             logger.error("missing sourcePath")
             return Status.FAILED
+        compressLevel = self.config.get("options",{}).get("zipCompressLevel", DEFAULTS_ZIP_COMPRESS_LEVEL)
+        zipMaxWorkers = self.config.get("options",{}).get("zipMaxWorkers", None)
         status = Status.OK
         for package in self.config.get("packages",[]):
             packageName = package.get("name",None)
             response    = makePySrcPackage( zipPackageName  = packageName,
                                             pySrcPath       = sourcePath,
                                             excludeDirs     = package.get( "sourceDirsToExclude", [] ),
-                                            addInit         = package.get( "addInitAtRoot", False ) )
+                                            addInit         = package.get( "addInitAtRoot", False ),
+                                            compressLevel   = compressLevel,
+                                            maxWorkers      = zipMaxWorkers )
             logger.info("Created package. Response: '%s'", response)
             if not response:
                 status = Status.FAILED
@@ -130,14 +171,28 @@ class AwsDeployExpert(object):
             os.environ["AWS_PROFILE"] = str(profile)
         else:
             logger.info("using AWS_PROFILE '%s'", os.environ.get("AWS_PROFILE", None))
-        self.cf_client = boto3.client('cloudformation')
-        self.s3_client = boto3.client('s3')
+        clientConfig = Config( max_pool_connections = AWS_MAX_POOL_CONNECTIONS,
+                               retries              = self.config.get("aws",{}).get("retries", AWS_RETRY_CONFIG) )
+        self.cf_client = boto3.client('cloudformation', config=clientConfig)
+        self.s3_client = boto3.client('s3', config=clientConfig)
+        self.s3_transfer_config = TransferConfig( multipart_threshold = AWS_S3_MULTIPART_THRESHOLD,
+                                                  multipart_chunksize = AWS_S3_MULTIPART_CHUNKSIZE,
+                                                  max_concurrency     = AWS_S3_MAX_CONCURRENCY,
+                                                  use_threads         = True,
+                                                  max_bandwidth       = self.config.get("aws",{}).get("maxBandwidth", None) )
+        self.s3_transfer = S3Transfer(self.s3_client, self.s3_transfer_config)
         return Status.OK
 
+    def _get_waiter_config(self) -> Dict:
+        """ Returns CloudFormation waiter config, allowing overrides via config["aws"]["waiter"] """
+        return self.config.get("aws", {}).get("waiter", AWS_CLOUDFORMATION_WAITER_CONFIG)
+
     def _upload_packages_to_s3_bucket(self) -> Status:
         """ Uploads packages to s3 source bucket """
         if not self.config.get("options",{}).get("uploadPackages", DEFAULTS_UPLOAD_PACKAGES):
             return Status.SKIPPED
+        uploads = []
+        copies  = []
         for package in self.config.get("packages", []):
             packageName = package.get("name", None)
             srcS3Bucket = package.get("aws", {}).get("srcS3Bucket", None)
@@ -145,15 +200,121 @@ class AwsDeployExpert(object):
             if not(packageName and srcS3Bucket and srcS3Key):
                 logger.error( "missing packageName or bucket or key; ('%s', '%s', '%s')", packageName,srcS3Bucket, srcS3Key )
                 return Status.FAILED
-            response = uploadFileToS3Bucket(self.s3_client, packageName, srcS3Bucket, srcS3Key)
-            logger.info("Uploaded package '%s' to S3 source bucket. Response: %s", packageName, response)
+            copyFromS3 = package.get("copyFromS3", None)
+            if copyFromS3:
+                if not(copyFromS3.get("s3Bucket", None) and copyFromS3.get("s3Key", None)):
+                    logger.error("missing s3Bucket or s3Key in copyFromS3 for package '%s'", packageName)
+                    return Status.FAILED
+                copies.append((packageName, copyFromS3["s3Bucket"], copyFromS3["s3Key"], srcS3Bucket, srcS3Key))
+            else:
+                uploads.append((packageName, srcS3Bucket, srcS3Key))
+        if copies:
+            status = self._copy_packages_inside_s3(copies)
+            if status == Status.FAILED:
+                return status
+        if not uploads:
+            return Status.OK
+        if aioboto3 is not None:
+            try:
+                asyncio.run(self._upload_packages_to_s3_bucket_async(uploads))
+            except Exception:
+                logger.exception("Failed to upload packages to S3 source bucket")
+                return Status.FAILED
+            return Status.OK
+        with ThreadPoolExecutor(max_workers=AWS_S3_UPLOAD_MAX_WORKERS) as pool:
+            futures = { pool.submit( uploadFileToS3Bucket, self.s3_transfer, packageName, srcS3Bucket, srcS3Key ): packageName
+                        for packageName, srcS3Bucket, srcS3Key in uploads }
+            for future in as_completed(futures):
+                packageName = futures[future]
+                try:
+                    response = future.result()
+                except Exception:
+                    logger.exception("Failed to upload package '%s' to S3 source bucket", packageName)
+                    return Status.FAILED
+                logger.info("Uploaded package '%s' to S3 source bucket. Response: %s", packageName, response)
+        return Status.OK
+
+    def _copy_packages_inside_s3(self, copies: List) -> Status:
+        """ Promotes packages that already live in S3 (e.g. staging to prod) with
+            server-side copies, so the bytes never transit this client """
+        with ThreadPoolExecutor(max_workers=AWS_S3_UPLOAD_MAX_WORKERS) as pool:
+            futures = { pool.submit( copyS3Object, self.s3_client, srcBucket, srcKey, dstBucket, dstKey,
+                                     transferConfig=self.s3_transfer_config ): packageName
+                        for packageName, srcBucket, srcKey, dstBucket, dstKey in copies }
+            for future in as_completed(futures):
+                packageName = futures[future]
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Failed to copy package '%s' between S3 buckets", packageName)
+                    return Status.FAILED
+                logger.info("Copied package '%s' to S3 source bucket inside S3", packageName)
+        return Status.OK
+
+    async def _upload_packages_to_s3_bucket_async(self, uploads: List) -> None:
+        """ Fans the package uploads out on an asyncio event loop via aioboto3.
+            Multiplexes all transfers on one thread instead of one OS thread per upload """
+        session = aioboto3.Session()
+        async with session.client('s3') as s3:
+            await asyncio.gather( *( s3.upload_file(packageName, srcS3Bucket, srcS3Key)
+                                     for packageName, srcS3Bucket, srcS3Key in uploads ) )
+        for packageName, srcS3Bucket, srcS3Key in uploads:
+            logger.info("Uploaded package '%s' to s3://%s/%s", packageName, srcS3Bucket, srcS3Key)
+
+    def _upload_packages_and_create_stacks(self) -> Status:
+        """ Runs package uploads and stack creation concurrently. create_stack is
+            asynchronous on the AWS side and Lambda code is only fetched once a
+            function is first invoked, so the two steps need not be serialized """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            uploadFuture = pool.submit(self._upload_packages_to_s3_bucket)
+            createFuture = pool.submit(self._create_stacks)
+            uploadStatus = uploadFuture.result()
+            createStatus = createFuture.result()
+        logger.info("upload_packages_to_s3 returned %s, create_stacks returned %s", uploadStatus, createStatus)
+        if Status.FAILED in (uploadStatus, createStatus):
+            return Status.FAILED
+        if uploadStatus == Status.SKIPPED and createStatus == Status.SKIPPED:
+            return Status.SKIPPED
         return Status.OK
 
     def _create_stacks(self) -> Status:
         """ Executes CloudFormation templates and creates stacks """
         if not self.config.get("options",{}).get("createStacks", DEFAULTS_CREATE_STACKS):
             return Status.SKIPPED
-        for stack in self.config.get("stacks", []):
+        batches = self._get_stack_batches()
+        if batches is None:
+            return Status.FAILED
+        for batch in batches:
+            status = self._submit_stacks(batch)
+            if status == Status.FAILED:
+                return status
+            status = self._await_stacks()
+            if status == Status.FAILED:
+                return status
+        return Status.OK
+
+    def _get_stack_batches(self) -> List:
+        """ Groups stacks into batches honoring optional "dependsOn" entries.
+            Stacks within a batch are independent and can be created concurrently.
+            Returns None when dependencies are cyclic or reference unknown stacks """
+        remaining = { stack.get("name", None): stack for stack in self.config.get("stacks", []) }
+        scheduled = set()
+        batches   = []
+        while remaining:
+            batch = [ stack for name, stack in remaining.items()
+                      if all(dep in scheduled for dep in stack.get("dependsOn", [])) ]
+            if not batch:
+                logger.error("cyclic or unknown stack dependencies among %s", list(remaining.keys()))
+                return None
+            for stack in batch:
+                scheduled.add(stack.get("name", None))
+                remaining.pop(stack.get("name", None))
+            batches.append(batch)
+        return batches
+
+    def _submit_stacks(self, stacks: List) -> Status:
+        """ Issues create_stack for every stack in the batch without waiting """
+        for stack in stacks:
             stackName           = stack.get("name", None)
             templatePath        = stack.get("templatePath", None)
             templateParamsPath  = stack.get("templateParamsPath", None)
@@ -161,17 +322,30 @@ class AwsDeployExpert(object):
             if not(stackName and templatePath and region):
                 logger.error( "missing stackName or templatePath or region; ('%s', '%s', '%s')", stackName and templatePath and region)
                 return Status.FAILED
-            with open(templatePath, 'r') as f:
-                templateBody = f.read()
+            templateBody = readTemplateBody(templatePath)
             parameters = []
             if templateParamsPath:
-                with open(templateParamsPath, 'r') as f:
-                    parameters.extend( json.loads(f.read()) )
+                parameters.extend( readTemplateParams(templateParamsPath) )
             parameters.extend(stack.get("params",{}))
             logger.info("Started CloudFormation create stack for '%s'", stackName)
             stackId = createStack(self.cf_client, stackName, templateBody, parameters, region)
             logger.info("StackId '%s' is '%s'", stackName, stackId)
-            waitCreateStackComplete(self.cf_client, stackName)
+            self.state.setdefault("pending_stacks", []).append(stackName)
+        return Status.OK
+
+    def _await_stacks(self) -> Status:
+        """ Waits for every pending stack in one shared poll loop, so total wait
+            time is max of creation times rather than their sum """
+        pending = self.state.get("pending_stacks", [])
+        if not pending:
+            return Status.OK
+        try:
+            waitStacksCreateComplete(self.cf_client, pending, waiterConfig=self._get_waiter_config())
+        except Exception:
+            logger.exception("Stacks %s failed to reach CREATE_COMPLETE", pending)
+            return Status.FAILED
+        self.state["pending_stacks"] = []
+        return Status.OK
 
     def _collect_stack_outputs(self) -> Status:
         """ Collects stack outputs and persists in the state. Returns status"""
@@ -180,8 +354,8 @@ class AwsDeployExpert(object):
         self.state["stacks"] = {}
         for stack in self.config.get("stacks", []):
             stackName   = stack.get("name", None)
-            outputs     = getStackOutputs(self.cf_client, stackName)
-            self.state["stacks"].update({stackName: {"outputs": outputs}})
+            outputs     = getStackOutputs(self.cf_client, stackName, waiterConfig=self._get_waiter_config())
+            self.state["stacks"].update({stackName: {"outputs": { o["OutputKey"]: o["OutputValue"] for o in outputs or [] }}})
         return Status.OK
 
     def _upload_static_artifacts(self) -> Status:
@@ -190,24 +364,43 @@ class AwsDeployExpert(object):
             return Status.SKIPPED
         for artifact in self.config.get("staticArtifacts", []):
             staticPath              = artifact.get("staticPath", None)
+            copyFromS3              = artifact.get("copyFromS3", None)
             stackNameForS3Bucket    = artifact.get("stackNameForS3Bucket", None)
             outputKeyForS3Bucket    = artifact.get("outputKeyForS3Bucket", None)
-            if not (staticPath and stackNameForS3Bucket and outputKeyForS3Bucket):
-                logger.error("missing staticPath or stackNameForS3Bucket or outputKeyForS3Bucket; ('%s', '%s', '%s')",
-                             staticPath and stackNameForS3Bucket and outputKeyForS3Bucket)
+            if not ((staticPath or copyFromS3) and stackNameForS3Bucket and outputKeyForS3Bucket):
+                logger.error("missing staticPath/copyFromS3 or stackNameForS3Bucket or outputKeyForS3Bucket; ('%s', '%s', '%s')",
+                             (staticPath or copyFromS3) and stackNameForS3Bucket and outputKeyForS3Bucket)
                 return Status.FAILED
             outputs = self.state.get("stacks",{}).get(stackNameForS3Bucket,{}).get("outputs",None)
             if not outputs:
                 logger.info("No outputs found for stack '%s'", stackNameForS3Bucket)
                 continue
-            staticS3Bucket = [x["OutputValue"] for x in outputs if x["OutputKey"] == outputKeyForS3Bucket][0].split(":")[-1]
+            bucketArn = outputs.get(outputKeyForS3Bucket, None)
+            if bucketArn is None:
+                logger.error("No output '%s' found for stack '%s'", outputKeyForS3Bucket, stackNameForS3Bucket)
+                continue
+            staticS3Bucket = bucketArn.rsplit(":", 1)[-1]
+            if copyFromS3:
+                if not(copyFromS3.get("s3Bucket", None) and copyFromS3.get("s3Key", None)):
+                    logger.error("missing s3Bucket or s3Key in copyFromS3 for stack '%s'", stackNameForS3Bucket)
+                    return Status.FAILED
+                dstS3Key = copyFromS3.get("destS3Key", copyFromS3["s3Key"])
+                logger.info("Copying static artifact s3://%s/%s to bucket %s inside S3", copyFromS3["s3Bucket"], copyFromS3["s3Key"], staticS3Bucket)
+                copyS3Object(self.s3_client, copyFromS3["s3Bucket"], copyFromS3["s3Key"], staticS3Bucket, dstS3Key,
+                             transferConfig=self.s3_transfer_config)
+                continue
             logger.info("Uploading static artifacts from '%s' to bucket %s", staticPath, staticS3Bucket)
-            uploadDirectoryToS3Bucket(self.s3_client, staticPath, staticS3Bucket)
+            uploadDirectoryToS3Bucket(self.s3_transfer, staticPath, staticS3Bucket)
         return Status.OK
 
 
 def runUnitTests( path: str ) -> bool:
-    """ Loads and runs tests from source path. Returns True if success """
+    """ Runs tests from source path, on pytest-xdist workers when available.
+        Returns True if success """
+    if importlib.util.find_spec("pytest") and importlib.util.find_spec("xdist"):
+        env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")  # keep __pycache__ out of the package walk
+        result = subprocess.run([sys.executable, "-m", "pytest", "-n", "auto", "-x", "-q", path], env=env, check=False)
+        return result.returncode == 0
     x = os.path.join(os.path.dirname(__file__), path)
     if x not in sys.path:
         sys.path.append(x)
@@ -216,33 +409,106 @@ def runUnitTests( path: str ) -> bool:
     result = unittest.TextTestRunner(verbosity=2).run(suite)
     return len(result.errors) == 0 and len(result.failures) == 0
 
-def makePySrcPackage( zipPackageName: str, pySrcPath: str, excludeDirs = None, addInit = False ) -> str:
-    def _filterFunc(root_, file_, excludeDirs_):
-        foldersToSkip = PYSRC_DIRS_ALWAYS_EXCLUDE + excludeDirs_
-        for fldName in foldersToSkip:
-            if fldName in root_:
-                return False
-        if str(file_).endswith(COMPILED_PYTHON_EXTENSION):
-            return False
-        return True
-    filterFunc = functools.partial(_filterFunc, excludeDirs_=excludeDirs or [])
-    with zipfile.ZipFile(zipPackageName,'w') as zh:
-        for root, dirs, files in os.walk(pySrcPath):
-            for file in files:
-                if filterFunc(root, file):
-                    arcname = os.path.join(root.replace(pySrcPath,''), file)
-                    zh.write(os.path.join(root, file),arcname=arcname, compress_type=zipfile.ZIP_DEFLATED)
-                    #zh.write(os.path.join(root, file) ,arcname=file)
-        if addInit:
+def hashSourceTree( path: str ) -> str:
+    """ Returns a sha256 digest of the python sources under path, built from
+        sorted (relpath, mtime_ns, size) tuples. Cheap stat-based fingerprint
+        used to decide whether the test suite needs to run again """
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for file in files:
+            if not file.endswith(".py"):
+                continue
+            fullPath = os.path.join(root, file)
+            st = os.stat(fullPath)
+            entries.append((os.path.relpath(fullPath, path), st.st_mtime_ns, st.st_size))
+    h = hashlib.sha256()
+    for entry in sorted(entries):
+        h.update(repr(entry).encode())
+    return h.hexdigest()
+
+def readTestCacheDigest() -> str:
+    try:
+        with open(TEST_CACHE_FILENAME, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def writeTestCacheDigest( digest: str ) -> None:
+    with open(TEST_CACHE_FILENAME, 'w') as f:
+        f.write(digest)
+
+def makePySrcPackage( zipPackageName: str, pySrcPath: str, excludeDirs = None, addInit = False,
+                      compressLevel: int = DEFAULTS_ZIP_COMPRESS_LEVEL, maxWorkers: int = None ) -> str:
+    excludeSet  = frozenset(PYSRC_DIRS_ALWAYS_EXCLUDE) | frozenset(excludeDirs or [])
+    basePath    = os.path.abspath(pySrcPath)
+    fileList    = []
+    for root, dirs, files in os.walk(basePath):
+        dirs[:] = [d for d in dirs if d not in excludeSet]  # prune excluded subtrees before descending
+        for file in files:
+            if file.endswith(COMPILED_PYTHON_EXTENSION):
+                continue
+            fullPath = os.path.join(root, file)
+            fileList.append((fullPath, os.path.relpath(fullPath, basePath)))
+    maxWorkers = maxWorkers or os.cpu_count() or 1
+    if maxWorkers > 1 and len(fileList) >= PARALLEL_ZIP_MIN_FILES:
+        makeZipParallel(zipPackageName, fileList, compressLevel, maxWorkers)
+    else:
+        with openZipForWrite(zipPackageName, 'w', compressLevel) as zh:
+            for fullPath, arcname in fileList:
+                zh.write(fullPath, arcname=arcname)
+    if addInit:
+        with openZipForWrite(zipPackageName, 'a', compressLevel) as zh:
             zh.write(os.path.join(pySrcPath, INIT_FILENAME),arcname=INIT_FILENAME)
     return zipPackageName
 
+@contextlib.contextmanager
+def openZipForWrite( zipPath: str, mode: str, compressLevel: int = DEFAULTS_ZIP_COMPRESS_LEVEL ):
+    """ Opens a zip for writing over a 1MiB-buffered file object, so deflate output
+        reaches the OS in large writes instead of the 8KB default, with ZIP64 on """
+    with open(zipPath, 'wb' if mode == 'w' else 'r+b', buffering=ZIP_WRITE_BUFFER_SIZE) as raw:
+        with zipfile.ZipFile(raw, mode, compression=zipCompression(compressLevel),
+                             compresslevel=compressLevel or None, allowZip64=True) as zh:
+            yield zh
+
+def zipCompression( compressLevel: int ) -> int:
+    return zipfile.ZIP_STORED if compressLevel == 0 else zipfile.ZIP_DEFLATED
+
+def makeZipParallel( zipPackageName: str, fileList: List, compressLevel: int, maxWorkers: int ) -> None:
+    """ Deflates file shards into temporary zips on a process pool, then merges
+        them into zipPackageName with the raw entry copier (no recompression).
+        Deflate holds the GIL, so threads do not help here - processes do """
+    shards = [ fileList[i::maxWorkers] for i in range(maxWorkers) ]
+    shards = [ shard for shard in shards if shard ]
+    tmpDir = tempfile.mkdtemp(prefix="awsdeploy-zip-")
+    try:
+        with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+            shardPaths = list( pool.map( makeZipShard,
+                                         shards,
+                                         [ os.path.join(tmpDir, "shard-%d.zip" % i) for i in range(len(shards)) ],
+                                         [ compressLevel ] * len(shards) ) )
+        with zipfile.ZipFile(zipPackageName, 'w'):
+            pass  # start from an empty archive; shards are appended below
+        for shardPath in shardPaths:
+            appendZipToZip(zipPackageName, shardPath)
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+def makeZipShard( shardFiles: List, shardZipPath: str, compressLevel: int ) -> str:
+    with openZipForWrite(shardZipPath, 'w', compressLevel) as zh:
+        for fullPath, arcname in shardFiles:
+            zh.write(fullPath, arcname=arcname)
+    return shardZipPath
+
 def addPackageLibs( zipPackageName: str, pyLibsPath: str, excludeLibs = None, includeLibs = None ) -> Status:
+    includeSet = frozenset(includeLibs or ())
+    excludeSet = frozenset(excludeLibs or ())
     for root, dirs, files in os.walk(pyLibsPath):
+        dirs[:] = [d for d in dirs if d not in PYSRC_DIRS_ALWAYS_EXCLUDE]
         for file in files:
             if not file.endswith(ZIPFILE_EXTENSION):
                 continue
-            if (includeLibs and file not in includeLibs) or (excludeLibs and file in excludeLibs):
+            if (includeSet and file not in includeSet) or (file in excludeSet):
                 logger.info("Skipped lib '%s' ", file)
                 continue
             zipFileAppendFrom = os.path.join(root, file)
@@ -251,32 +517,97 @@ def addPackageLibs( zipPackageName: str, pyLibsPath: str, excludeLibs = None, in
     return Status.OK
 
 def appendZipToZip( zipFileAppendTo: str, zipFileAppendFrom: str ) -> Status:
-    """ Appends contents from one zip file to another zip file """
-    z1 = zipfile.ZipFile( zipFileAppendTo, 'a' )
-    z2 = zipfile.ZipFile( zipFileAppendFrom, 'r' )
-    for t in ((n, z2.open(n)) for n in z2.namelist()):
-        #z1.writestr(t[0], t[1].read(), compress_type=zipfile.ZIP_DEFLATED)
-        zip_info = zipfile.ZipInfo(t[0])
-        zip_info.compress_type = zipfile.ZIP_DEFLATED
-        zip_info.create_system = 3  # Specifies Unix
-        zip_info.external_attr = 0o777 << 16  # Sets chmod 777 on the file
-        z1.writestr(zip_info, t[1].read(), compress_type=zipfile.ZIP_DEFLATED)
-    z1.close()
+    """ Appends contents from one zip file to another zip file without recompressing entries """
+    with openZipForWrite( zipFileAppendTo, 'a' ) as z1, zipfile.ZipFile( zipFileAppendFrom, 'r' ) as z2:
+        for info in z2.infolist():
+            copyZipEntryRaw(z1, z2, info)
     return Status.OK
 
-def uploadFileToS3Bucket(s3_client: Any, filePath: str, s3Bucket: str, s3Key: str) -> str:
-    """ Uploads file to s3 bucket using boto3 s3 client """
-    return s3_client.upload_file(filePath, s3Bucket, s3Key)
-
-def uploadDirectoryToS3Bucket(s3_client: Any, dirPath: str, s3Bucket: str) -> Status:
+def copyZipEntryRaw( zipTo: zipfile.ZipFile, zipFrom: zipfile.ZipFile, info: zipfile.ZipInfo ) -> None:
+    """ Copies a single entry between open zip files keeping its compressed bytes verbatim.
+        Seeks past the source local file header, replays the payload under a fresh header
+        in the destination and registers the entry so close() writes a valid central directory """
+    zipFrom.fp.seek(info.header_offset)
+    header = zipFrom.fp.read(30)
+    nameLength, extraLength = struct.unpack("<HH", header[26:30])
+    zipFrom.fp.seek(info.header_offset + 30 + nameLength + extraLength)
+    zip_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    zip_info.compress_type = info.compress_type
+    zip_info.flag_bits     = info.flag_bits & ~0x08  # raw copy writes no data descriptor
+    zip_info.create_system = 3  # Specifies Unix
+    zip_info.external_attr = 0o777 << 16  # Sets chmod 777 on the file
+    zip_info.CRC           = info.CRC
+    zip_info.compress_size = info.compress_size
+    zip_info.file_size     = info.file_size
+    zipTo.fp.seek(zipTo.start_dir)
+    zip_info.header_offset = zipTo.fp.tell()
+    needsZip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+    zipTo.fp.write(zip_info.FileHeader(zip64=needsZip64))
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = zipFrom.fp.read(min(ZIP_COPY_BUFFER_SIZE, remaining))
+        if not chunk:
+            raise IOError("truncated entry '%s' in '%s'" % (info.filename, zipFrom.filename))
+        zipTo.fp.write(chunk)
+        remaining -= len(chunk)
+    zipTo.filelist.append(zip_info)
+    zipTo.NameToInfo[zip_info.filename] = zip_info
+    zipTo.start_dir = zipTo.fp.tell()
+    zipTo._didModify = True  # so close() rewrites the central directory
+
+def uploadFileToS3Bucket(s3_transfer: Any, filePath: str, s3Bucket: str, s3Key: str) -> str:
+    """ Uploads file to s3 bucket using a shared boto3 S3Transfer manager """
+    return s3_transfer.upload_file(filePath, s3Bucket, s3Key)
+
+def copyS3Object(s3_client: Any, srcS3Bucket: str, srcS3Key: str, dstS3Bucket: str, dstS3Key: str, transferConfig: Any = None) -> None:
+    """ Copies an object between buckets inside the S3 back-plane (UploadPartCopy),
+        so the bytes never leave AWS """
+    s3_client.copy( CopySource = { 'Bucket': srcS3Bucket, 'Key': srcS3Key },
+                    Bucket     = dstS3Bucket,
+                    Key        = dstS3Key,
+                    Config     = transferConfig )
+
+def uploadDirectoryToS3Bucket(s3_transfer: Any, dirPath: str, s3Bucket: str, maxConcurrency: int = AWS_S3_DIRECTORY_UPLOAD_MAX_WORKERS) -> Status:
+    """ Uploads every file under dirPath to s3 bucket using a bounded worker pool """
+    tasks = []
     for subdir, dirs, files in os.walk(dirPath):
         for fileName in files:
             full_path   = os.path.join(subdir, fileName)
-            key         = full_path[len(dirPath):].replace("\\", "/")
-            response    = uploadFileToS3Bucket( s3_client, full_path, s3Bucket, s3Key=key)
-            logger.info("Uploaded '%s' to key '%s' in bucket %s. Response: %s", fileName, key,s3Bucket, response)
+            key         = os.path.relpath(full_path, dirPath).replace(os.sep, "/")
+            tasks.append((full_path, key))
+    with ThreadPoolExecutor(max_workers=maxConcurrency) as pool:
+        futures = { pool.submit( uploadFileToS3Bucket, s3_transfer, full_path, s3Bucket, s3Key=key ): (full_path, key)
+                    for full_path, key in tasks }
+        for future in as_completed(futures):
+            full_path, key = futures[future]
+            try:
+                response = future.result()
+            except Exception:
+                logger.exception("Failed to upload '%s' to key '%s' in bucket %s", full_path, key, s3Bucket)
+                for pending in futures:
+                    pending.cancel()
+                return Status.FAILED
+            logger.info("Uploaded '%s' to key '%s' in bucket %s. Response: %s", full_path, key, s3Bucket, response)
     return Status.OK
 
+def readTemplateBody(templatePath: str) -> str:
+    """ Returns template file contents, cached until the file changes on disk """
+    return _readTextFileCached(templatePath, os.path.getmtime(templatePath))
+
+def readTemplateParams(templateParamsPath: str) -> List:
+    """ Returns parsed template parameters, cached until the file changes on disk """
+    return _readJsonFileCached(templateParamsPath, os.path.getmtime(templateParamsPath))
+
+@functools.lru_cache(maxsize=128)
+def _readTextFileCached(path: str, mtime: float) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=128)
+def _readJsonFileCached(path: str, mtime: float) -> List:
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
 def createStack(cf_client: Any, stackName: str, templateBody: str, parameters: List, region: str)-> str:
     """ Returns StackId """
     response = cf_client.create_stack(
@@ -287,29 +618,43 @@ def createStack(cf_client: Any, stackName: str, templateBody: str, parameters: L
     )
     return response
 
-def waitCreateStackComplete(cf_client: Any, stackName: str) -> None:
+def waitStacksCreateComplete(cf_client: Any, stackNames: List, waiterConfig: Dict = None) -> None:
+    """ Waits for all stacks to reach CREATE_COMPLETE using one unfiltered
+        describe_stacks call per poll interval, regardless of fan-out width.
+        Per-stack waiters each issue their own DescribeStacks per interval,
+        which gets throttled at scale """
+    config      = waiterConfig or AWS_CLOUDFORMATION_WAITER_CONFIG
+    delay       = config.get("Delay", AWS_CLOUDFORMATION_WAITER_CONFIG["Delay"])
+    maxAttempts = config.get("MaxAttempts", AWS_CLOUDFORMATION_WAITER_CONFIG["MaxAttempts"])
+    pending     = set(stackNames)
+    for attempt in range(maxAttempts):
+        statuses = {}
+        for page in cf_client.get_paginator('describe_stacks').paginate():
+            for stack in page["Stacks"]:
+                statuses[stack["StackName"]] = stack["StackStatus"]
+        for stackName in list(pending):
+            status = statuses.get(stackName, None)
+            if status == AWS_CLOUDFORMATION_CREATE_COMPLETE:
+                logger.info("Stack '%s' reached CREATE_COMPLETE", stackName)
+                pending.discard(stackName)
+            elif status in (AWS_CLOUDFORMATION_CREATE_IN_PROGRESS, None):
+                continue
+            else:
+                raise RuntimeError("Stack '%s' entered unexpected status '%s'" % (stackName, status))
+        if not pending:
+            return
+        logger.info("Stacks %s still in progress. sleeping %d seconds", sorted(pending), delay)
+        time.sleep(delay)
+    raise TimeoutError("Stacks %s did not reach CREATE_COMPLETE within %d attempts" % (sorted(pending), maxAttempts))
+
+def waitCreateStackComplete(cf_client: Any, stackName: str, waiterConfig: Dict = None) -> None:
     waiter = cf_client.get_waiter('stack_create_complete')
-    waiter.wait( StackName=stackName, NextToken='string', WaiterConfig=AWS_CLOUDFORMATION_WAITER_CONFIG )
+    waiter.wait( StackName=stackName, WaiterConfig=waiterConfig or AWS_CLOUDFORMATION_WAITER_CONFIG )
 
-def getStackOutputs(cf_client: Any, stackName: str) -> Dict:
+def getStackOutputs(cf_client: Any, stackName: str, waiterConfig: Dict = None) -> List:
     """ Returns StackOutputs """
-    timeoutSeconds  = AWS_COLLECT_OUTPUTS_CONFIG.get("Timeout", -1)
-    sleepSeconds    = AWS_COLLECT_OUTPUTS_CONFIG.get("SleepSeconds", 1)
-    elapsedSeconds  = 0
-    stackOutputs    = None
-    while elapsedSeconds < timeoutSeconds:
-        stackDesc = describeStack(cf_client, stackName)
-        status = stackDesc["Stacks"][0]["StackStatus"]
-        if status == AWS_CLOUDFORMATION_CREATE_COMPLETE:
-            stackOutputs = stackDesc["Stacks"][0]["Outputs"]
-            break
-        elif status == AWS_CLOUDFORMATION_CREATE_IN_PROGRESS:
-            logger.info("Stack '%s' status is CREATE_IN_PROGRESS. sleeping %d seconds", stackName, sleepSeconds)
-            elapsedSeconds += sleepSeconds
-            time.sleep(sleepSeconds)
-        else:
-            raise stackDesc
-    return stackOutputs
+    waitCreateStackComplete(cf_client, stackName, waiterConfig=waiterConfig)
+    return describeStack(cf_client, stackName)["Stacks"][0].get("Outputs", [])
 
 def describeStack(cf_client: Any, stackName):
     """ Returns Summary Info for created stack """